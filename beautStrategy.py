@@ -1,8 +1,9 @@
 import sys
+import math
 import random
 import time
 
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, FrozenSet
 from enum import Enum
 from collections import deque, Counter
 from copy import deepcopy
@@ -21,7 +22,20 @@ HAS_INGREDIENTS_TARGET_PERCENTAGE = 0.85
 ACTION_PATH_DEDUPE_MAX_SIMILAR_ACTIONS = 2
 MAX_VALID_PATHS = 30
 TOME_SPELL_ORDER_MATCHING_TARGET_PERCENTAGE = 0.75
-MAX_ACTIONS_FOR_VALID_PATH = 1
+# REST counts as a turn too, so this is how far ahead the search looks
+MAX_TURNS_FOR_ACTION_PATH = 4
+# Turns are 50ms, stop searching well before that and go with what we've found. This counts the nodes we generate
+# rather than milliseconds so the same input always gives the same move
+MAX_SEARCH_NODES = 300
+# Calculated based off number of actions to get two of a single tier ingredient
+# Tier 0 = 1 action     (starting spell is 2 tier zeros for free)
+# Tier 1 = 4 actions    (1 action for 2 tier zeros, then use starting spell to convert 1 tier zero to 1 tier one, then REST, then repeat spell)
+# Tier 2 = 7 actions    (4 actions for 2 tier ones, then use starting spell to convert 1 tier one to 1 tier two, then REST, then repeat spell)
+# Tier 3 = 10 actions   (7 actions for 2 tier twos, then use starting spell to convert 1 tier two to 1 tier three, then REST, then repeat spell)
+TIER_0_WEIGHT = 1
+TIER_1_WEIGHT = 4
+TIER_2_WEIGHT = 7
+TIER_3_WEIGHT = 10
 
 #####################
 ###### Classes ######
@@ -64,20 +78,19 @@ class Ingredients(StringRepresenter):
         return self.__tierQuantities.get(tier, 0)
 
     def getPositiveTiersWeight(self) -> int:
-        # Calculated based off number of actions to get two of a single tier ingredient
-        # Tier 0 = 1 action     (starting spell is 2 tier zeros for free)
-        # Tier 1 = 4 actions    (1 action for 2 tier zeros, then use starting spell to convert 1 tier zero to 1 tier one, then REST, then repeat spell)
-        # Tier 2 = 7 actions    (4 actions for 2 tier ones, then use starting spell to convert 1 tier one to 1 tier two, then REST, then repeat spell)
-        # Tier 3 = 10 actions   (7 actions for 2 tier twos, then use starting spell to convert 1 tier two to 1 tier three, then REST, then repeat spell)
-
+        # See the TIER_*_WEIGHT toggles for how these were picked
         tierWeights = {
-            IngredientTier.TIER_0: 1,
-            IngredientTier.TIER_1: 4,
-            IngredientTier.TIER_2: 7,
-            IngredientTier.TIER_3: 10
+            IngredientTier.TIER_0: TIER_0_WEIGHT,
+            IngredientTier.TIER_1: TIER_1_WEIGHT,
+            IngredientTier.TIER_2: TIER_2_WEIGHT,
+            IngredientTier.TIER_3: TIER_3_WEIGHT
         }
         return sum([self.getQuantity(tier) * tierWeights[tier] for tier in self.__tierQuantities if self.getQuantity(tier) > 0])
 
+    # How much closer (by weight) a cast of these ingredients can possibly bring us to any target
+    def getMaxMissingWeightReduction(self) -> int:
+        return self.getPositiveQuantities().getPositiveTiersWeight()
+
     def getPositiveTiersTotalQuantity(self) -> int:
         return sum([self.getQuantity(tier) for tier in self.__tierQuantities if self.getQuantity(tier) > 0])
 
@@ -141,6 +154,9 @@ class Ingredients(StringRepresenter):
 
         return 1 - percentageMissing >= targetPercentage
 
+    def asTuple(self) -> tuple:
+        return tuple(self.getQuantity(tier) for tier in IngredientTier)
+
     def equals(self, other: 'Ingredients') -> bool:
         for tier in IngredientTier:
             if self.getQuantity(tier) != other.getQuantity(tier):
@@ -219,16 +235,17 @@ class TomeSpell(StringRepresenter):
 
 
 class SpellTraversalNode(StringRepresenter):
-    def __init__(self, curInventory: Ingredients, learnedSpellsById: Dict[str, Spell], actionsSoFar: [str]):
+    def __init__(self, curInventory: Ingredients, exhaustedSpellIds: FrozenSet[str], actionsSoFar: [str]):
         self.__curInventory = curInventory
-        self.__learnedSpellsById = learnedSpellsById
+        self.__exhaustedSpellIds = exhaustedSpellIds
         self.__actionsSoFar = actionsSoFar
 
     def getCurInventory(self) -> Ingredients:
         return self.__curInventory
 
-    def getLearnedSpellsById(self) -> Dict[str, Spell]:
-        return self.__learnedSpellsById
+    # Spells that have been cast since the last REST
+    def getExhaustedSpellIds(self) -> FrozenSet[str]:
+        return self.__exhaustedSpellIds
 
     # Chronological order of the actions we've taken in this action path so far
     def getActionsSoFar(self) -> [str]:
@@ -250,52 +267,87 @@ class Witch(StringRepresenter):
 
         return True
 
+    # Breadth first branch and bound over CAST and REST actions, each costing one turn, so the shortest paths come first
+    # and everything that can't tie them gets pruned. Returns the paths that reach the target, or if none do within
+    # MAX_TURNS_FOR_ACTION_PATH, the paths that got cut off so we can still make progress.
+    # Gives up after generating MAX_SEARCH_NODES nodes and returns whatever it has by then.
     def actionsToGetTargetInventory(self, startingInventory: Ingredients, targetInventory: Ingredients) -> [ActionPath]:
         assert startingInventory.hasNoNegativeQuantities() and targetInventory.hasNoNegativeQuantities()
         validActionPaths = []
+        partialActionPaths = []
 
         if startingInventory.has(targetInventory):
             return validActionPaths
 
-        stack = deque()
-        rootNode = SpellTraversalNode(startingInventory, self.spellsById, [])
+        maxMissingWeightReductionPerCast = max([spell.ingredients.getMaxMissingWeightReduction() for spell in self.spellsById.values()], default=0)
+        fewestValidPathTurns = math.inf
+        # The same inventory and exhausted spells can be reached through different cast orders, only expand it once
+        fewestTurnsByState = {}
+        queue = deque()
+        rootNode = SpellTraversalNode(
+            startingInventory,
+            frozenset(spell.spellId for spell in self.spellsById.values() if not spell.castable),
+            []
+        )
         # logDebug(f"starting inventory: {startingInventory}")
-        stack.append(rootNode)
-        while len(stack) > 0:
-            # logDebug(f"stack length: {len(stack)}")
-            curNode: SpellTraversalNode = stack.pop()
-            for spell in getBestSpells(curNode.getLearnedSpellsById(), curNode.getCurInventory(), targetInventory):
-                actionsToAdd = []
-                updatedLearnedSpells = deepcopy(curNode.getLearnedSpellsById())
-                resultingInventoryAfterSpellCast = curNode.getCurInventory().merge(spell.ingredients)
-
-                tookRest = False
-                if not spell.castable:
-                    # Take a REST
-                    tookRest = True
-                    actionsToAdd.append(ActionType.REST.value)
-                    updatedLearnedSpells = refreshSpells(curNode.getLearnedSpellsById())
-
-                # Cast spell!
-                updatedLearnedSpells.get(spell.spellId).castable = 0
-                actionsToAdd.append(spell.getActionToCast())
-                updatedActionsSoFar = curNode.getActionsSoFar() + actionsToAdd
-
-                if resultingInventoryAfterSpellCast.has(
-                        targetInventory,
-                        targetPercentage=HAS_INGREDIENTS_TARGET_PERCENTAGE
-                ) or tookRest:
+        queue.append(rootNode)
+        numNodesGenerated = 0
+        while len(queue) > 0:
+            # logDebug(f"queue length: {len(queue)}")
+            if numNodesGenerated >= MAX_SEARCH_NODES:
+                logDebug(f"Out of search budget with {len(queue)} nodes left in the queue")
+                if len(validActionPaths) == 0 and len(partialActionPaths) == 0:
+                    # Ran out before anything got cut off, so the frontier is the best progress we've got
+                    partialActionPaths = [ActionPath(node.getActionsSoFar(), node.getCurInventory()) for node in list(queue)[:MAX_VALID_PATHS]]
+                break
+            curNode: SpellTraversalNode = queue.popleft()
+            castableSpellsById = {
+                spellId: spell for spellId, spell in self.spellsById.items() if spellId not in curNode.getExhaustedSpellIds()
+            }
+            childNodes = [
+                SpellTraversalNode(
+                    curNode.getCurInventory().merge(spell.ingredients),
+                    curNode.getExhaustedSpellIds().union([spell.spellId]),
+                    curNode.getActionsSoFar() + [spell.getActionToCast()]
+                ) for spell in getBestSpells(castableSpellsById, curNode.getCurInventory(), targetInventory)
+            ]
+            if len(curNode.getExhaustedSpellIds()) > 0:
+                # REST costs a turn like anything else, but makes every spell castable again
+                childNodes.append(SpellTraversalNode(curNode.getCurInventory(), frozenset(), curNode.getActionsSoFar() + [ActionType.REST.value]))
+
+            numNodesGenerated += len(childNodes)
+            for childNode in childNodes:
+                resultingInventory = childNode.getCurInventory()
+                actionsSoFar = childNode.getActionsSoFar()
+                if resultingInventory.has(targetInventory, targetPercentage=HAS_INGREDIENTS_TARGET_PERCENTAGE):
                     # Leaf node, finalize action path
-                    logDebug(f"Action path: {updatedActionsSoFar}")
-                    validActionPath = ActionPath(updatedActionsSoFar, resultingInventoryAfterSpellCast)
-                    validActionPaths.append(validActionPath)
+                    logDebug(f"Action path: {actionsSoFar}")
+                    validActionPaths.append(ActionPath(actionsSoFar, resultingInventory))
+                    fewestValidPathTurns = min(fewestValidPathTurns, len(actionsSoFar))
                     if len(validActionPaths) == MAX_VALID_PATHS:
                         return validActionPaths
-                else:
-                    if shouldContinueTraversal(updatedActionsSoFar, validActionPaths):
-                        stack.append(SpellTraversalNode(resultingInventoryAfterSpellCast, updatedLearnedSpells, updatedActionsSoFar))
-
-        return validActionPaths
+                    continue
+
+                state = (resultingInventory.asTuple(), childNode.getExhaustedSpellIds())
+                if fewestTurnsByState.get(state, math.inf) <= len(actionsSoFar):
+                    continue
+                fewestTurnsByState[state] = len(actionsSoFar)
+
+                minTurnsLeft = estimateMinTurnsToTargetInventory(
+                    resultingInventory,
+                    targetInventory,
+                    [spell for spellId, spell in self.spellsById.items() if spellId not in childNode.getExhaustedSpellIds()],
+                    maxMissingWeightReductionPerCast
+                )
+                if len(actionsSoFar) + minTurnsLeft > fewestValidPathTurns:
+                    # Can't tie the best path we already have
+                    continue
+                if shouldContinueTraversal(actionsSoFar, validActionPaths, minTurnsLeft):
+                    queue.append(childNode)
+                elif len(validActionPaths) == 0 and len(partialActionPaths) < MAX_VALID_PATHS:
+                    partialActionPaths.append(ActionPath(actionsSoFar, resultingInventory))
+
+        return validActionPaths if len(validActionPaths) > 0 else partialActionPaths
 
     def actionsToGetInventory(self, desiredInventory: Ingredients) -> Optional[ActionPath]:
         possibleActionPaths = self.actionsToGetTargetInventory(self.inventory, desiredInventory)
@@ -396,17 +448,6 @@ def logDebug(msg: str):
     print(msg, file=sys.stderr, flush=True)
 
 
-def refreshSpells(spells: Dict[str, Spell]):
-    def refreshSpell(spell: Spell) -> Spell:
-        newSpell = deepcopy(spell)
-        newSpell.castable = 1
-        return newSpell
-
-    return {
-        spell.spellId : refreshSpell(spell) for spell in spells.values()
-    }
-
-
 def timed(method):
     def timeMethod(*args, **kw):
         startTime = time.time()
@@ -551,15 +592,37 @@ def getBestSpells(spells: Dict[str, Spell], curInventory: Ingredients, targetInv
     return spellsToSort
 
 
-def shouldContinueTraversal(actionsSoFar: [str], validActionPaths: [ActionPath]) -> bool:
+# Admissible lower bound on the turns left to reach the target inventory, so it's safe to prune with.
+# Every cast shrinks the missing ingredients weight by at most the weight of what it creates, and REST creates nothing.
+def estimateMinTurnsToTargetInventory(curInventory: Ingredients, targetInventory: Ingredients, castableSpells: [Spell],
+                                      maxMissingWeightReductionPerCast: int) -> float:
+    inventoryDiff = curInventory.subtract(targetInventory)
+    missingWeight = inventoryDiff.getNegativeQuantities(True).getPositiveTiersWeight()
+    allowedMissingWeight = (1 - HAS_INGREDIENTS_TARGET_PERCENTAGE) * targetInventory.getPositiveTiersWeight()
+    weightToReduce = missingWeight - allowedMissingWeight
+    if weightToReduce <= 0:
+        return 0
+    if maxMissingWeightReductionPerCast == 0:
+        return math.inf
+
+    # Small epsilon so float error in the allowed weight can't push us over and make the bound inadmissible
+    minCasts = math.ceil(weightToReduce / maxMissingWeightReductionPerCast - 1e-9)
+    if not any(spell.createsAny(inventoryDiff.getNegativeTiers()) for spell in castableSpells):
+        # Nothing castable right now helps, so we'll have to REST at least once
+        return minCasts + 1
+    return minCasts
+
+
+def shouldContinueTraversal(actionsSoFar: [str], validActionPaths: [ActionPath], minTurnsLeft: float) -> bool:
     for validActionPath in validActionPaths:
+        validActions = validActionPath.getActions()
         for actionIndex in range(ACTION_PATH_DEDUPE_MAX_SIMILAR_ACTIONS):
-            if actionsSoFar[actionIndex] != validActionPath.getActions()[actionIndex]:
+            if actionIndex >= len(actionsSoFar) or actionIndex >= len(validActions) or actionsSoFar[actionIndex] != validActions[actionIndex]:
                 break
             if actionIndex == ACTION_PATH_DEDUPE_MAX_SIMILAR_ACTIONS - 1:
                 return False
 
-    return len(actionsSoFar) <= MAX_ACTIONS_FOR_VALID_PATH
+    return len(actionsSoFar) + minTurnsLeft <= MAX_TURNS_FOR_ACTION_PATH
 
 
 def findShortestActionPath(actionPaths: [ActionPath]) -> Optional[ActionPath]:
@@ -580,6 +643,9 @@ def findClosestToTargetInventory(actionPaths: [ActionPath], targetInventory: Ing
     def calculateMissingIngredientsWeight(resultingInventoryForActionPath: Ingredients, targetInventory: Ingredients):
         return resultingInventoryForActionPath.subtract(targetInventory).getNegativeQuantities(True).getPositiveTiersWeight()
 
+    if len(actionPaths) == 0:
+        logDebug("Couldn't find any possible action path")
+        return None
     lowestActionPath = min(actionPaths,
         key=lambda actionPath: calculateMissingIngredientsWeight(actionPath.getResultingInventory(), targetInventory))
     lowestActionPathWeight = calculateMissingIngredientsWeight(lowestActionPath.getResultingInventory(), targetInventory)
@@ -712,5 +778,7 @@ def learnSpellsSean(gameState: GameState) -> Optional[str]:
     # if numSpellsLearnedFromTomeSoFar < 5 or firstSpell.tier0Earned > 0:
     #     return f"{ActionType.LEARN.value} {firstSpell.spellId}"
 
-while True:
-    runAlgo(parseInput())
+
+if __name__ == "__main__":
+    while True:
+        runAlgo(parseInput())
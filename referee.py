@@ -0,0 +1,355 @@
+import io
+import os
+import random
+import sys
+import time
+
+from typing import Optional, List, Dict, Tuple, TextIO
+from contextlib import redirect_stdout, redirect_stderr
+
+import beautStrategy
+from beautStrategy import ActionType, IngredientTier, Ingredients, ALL_ORDERS_COSTS, ALL_TOME_SPELLS_DELTAS, MAX_INVENTORY_SIZE
+
+# Local re-implementation of the Fall Challenge 2020 referee so we can play our bot against itself offline.
+# It follows the rules from the contest statement closely enough for tuning, but isn't byte for byte the real thing.
+
+#####################
+##### Constants #####
+#####################
+# Prices line up index for index with ALL_ORDERS_COSTS
+ALL_ORDERS_PRICES = [6, 7, 8, 8, 9, 10, 10, 10, 10, 11, 11, 12, 12, 12, 13, 14, 14, 14, 15, 16, 16, 17, 18, 20,
+                     9, 12, 12, 13, 15, 17, 19, 12, 14, 16, 18, 20]
+STARTING_SPELLS_DELTAS = [
+    Ingredients.fromTierArgs(2, 0, 0, 0),
+    Ingredients.fromTierArgs(-1, 1, 0, 0),
+    Ingredients.fromTierArgs(0, -1, 1, 0),
+    Ingredients.fromTierArgs(0, 0, -1, 1)
+]
+STARTING_INVENTORY = Ingredients.fromTierArgs(3, 0, 0, 0)
+# Ids mirror the real referee: tome spells are 0-41, orders 42-77, starting spells 78-85 and learned spells after that
+FIRST_ORDER_ID = len(ALL_TOME_SPELLS_DELTAS)
+FIRST_STARTING_SPELL_ID = FIRST_ORDER_ID + len(ALL_ORDERS_COSTS)
+FIRST_LEARNED_SPELL_ID = FIRST_STARTING_SPELL_ID + 2 * len(STARTING_SPELLS_DELTAS)
+NUM_VISIBLE_ORDERS = 5
+NUM_VISIBLE_TOME_SPELLS = 6
+# The first two orders get an urgency bonus for the first few potions brewed from their slot
+URGENCY_BONUSES = [3, 1]
+URGENCY_BONUS_USES = 4
+POTIONS_TO_END_GAME = 6
+MAX_ROUNDS = 100
+FIRST_TURN_TIME_LIMIT_MS = 1000
+TURN_TIME_LIMIT_MS = 50
+# Multiplies both time limits, bump it down if this machine is faster than the CodinGame servers
+LOCAL_TIME_LIMIT_SCALE = 1.0
+
+# Toggles from beautStrategy that can be overridden per player
+TOGGLE_NAMES = [
+    "HAS_INGREDIENTS_TARGET_PERCENTAGE",
+    "ACTION_PATH_DEDUPE_MAX_SIMILAR_ACTIONS",
+    "MAX_VALID_PATHS",
+    "TOME_SPELL_ORDER_MATCHING_TARGET_PERCENTAGE",
+    "MAX_TURNS_FOR_ACTION_PATH",
+    "TIER_0_WEIGHT",
+    "TIER_1_WEIGHT",
+    "TIER_2_WEIGHT",
+    "TIER_3_WEIGHT"
+]
+DEFAULT_TOGGLES = {
+    name: getattr(beautStrategy, name) for name in TOGGLE_NAMES
+}
+
+#####################
+###### Classes ######
+#####################
+
+
+def toTierList(ingredients: Ingredients) -> List[int]:
+    return [ingredients.getQuantity(tier) for tier in IngredientTier]
+
+
+class SimulatedSpell(beautStrategy.StringRepresenter):
+    def __init__(self, spellId: int, deltas: List[int], repeatable: bool):
+        self.spellId = spellId
+        self.deltas = deltas
+        self.repeatable = repeatable
+        self.castable = True
+
+
+class SimulatedTomeSpell(beautStrategy.StringRepresenter):
+    def __init__(self, spellId: int, deltas: List[int]):
+        self.spellId = spellId
+        self.deltas = deltas
+        self.tax = 0
+
+
+class SimulatedOrder(beautStrategy.StringRepresenter):
+    def __init__(self, orderId: int, costs: List[int], price: int):
+        self.orderId = orderId
+        self.costs = costs
+        self.price = price
+
+
+class SimulatedWitch(beautStrategy.StringRepresenter):
+    def __init__(self, firstSpellId: int):
+        self.inventory = toTierList(STARTING_INVENTORY)
+        self.rupees = 0
+        self.potionsBrewed = 0
+        self.spells = [
+            SimulatedSpell(firstSpellId + i, toTierList(delta), False) for i, delta in enumerate(STARTING_SPELLS_DELTAS)
+        ]
+
+    def getSpell(self, spellId: int) -> Optional[SimulatedSpell]:
+        return next((s for s in self.spells if s.spellId == spellId), None)
+
+    def getScore(self) -> int:
+        # Every ingredient above tier 0 is worth a rupee at the end of the game
+        return self.rupees + sum(self.inventory[1:])
+
+
+class GameResult(beautStrategy.StringRepresenter):
+    def __init__(self, scores: List[int], winner: Optional[int], latenciesMs: List[List[float]], forfeited: List[bool], rounds: int):
+        self.scores = scores
+        self.winner = winner  # None on a draw
+        self.latenciesMs = latenciesMs  # per player, one entry per turn
+        self.forfeited = forfeited
+        self.rounds = rounds
+
+    # 1 for a win, 0.5 for a draw and 0 for a loss
+    def getPoints(self, playerIndex: int) -> float:
+        if self.winner is None:
+            return 0.5
+        return 1.0 if self.winner == playerIndex else 0.0
+
+
+class InvalidActionError(Exception):
+    pass
+
+
+class TurnTimeoutError(Exception):
+    pass
+
+
+class SimulatedGame(beautStrategy.StringRepresenter):
+    def __init__(self, seed: int):
+        rng = random.Random(seed)
+        self.orderDeck = [
+            SimulatedOrder(FIRST_ORDER_ID + i, toTierList(cost), ALL_ORDERS_PRICES[i]) for i, cost in enumerate(ALL_ORDERS_COSTS)
+        ]
+        self.tomeDeck = [
+            SimulatedTomeSpell(i, toTierList(delta)) for i, delta in enumerate(ALL_TOME_SPELLS_DELTAS)
+        ]
+        rng.shuffle(self.orderDeck)
+        rng.shuffle(self.tomeDeck)
+        self.orders: List[SimulatedOrder] = []
+        self.tomeSpells: List[SimulatedTomeSpell] = []
+        self.urgencyBonusUsesLeft = [URGENCY_BONUS_USES for _ in URGENCY_BONUSES]
+        self.witches = [
+            SimulatedWitch(FIRST_STARTING_SPELL_ID + i * len(STARTING_SPELLS_DELTAS)) for i in range(2)
+        ]
+        self.nextLearnedSpellId = FIRST_LEARNED_SPELL_ID
+        self.round = 0
+        self.refill()
+
+    def refill(self):
+        while len(self.orders) < NUM_VISIBLE_ORDERS and len(self.orderDeck) > 0:
+            self.orders.append(self.orderDeck.pop())
+        while len(self.tomeSpells) < NUM_VISIBLE_TOME_SPELLS and len(self.tomeDeck) > 0:
+            self.tomeSpells.append(self.tomeDeck.pop())
+
+    def getUrgencyBonus(self, orderIndex: int) -> Tuple[int, int]:
+        if orderIndex < len(URGENCY_BONUSES) and self.urgencyBonusUsesLeft[orderIndex] > 0:
+            return URGENCY_BONUSES[orderIndex], self.urgencyBonusUsesLeft[orderIndex]
+        return 0, 0
+
+    # The exact lines the bot reads from stdin on its turn
+    def buildFrame(self, playerIndex: int) -> List[str]:
+        us = self.witches[playerIndex]
+        them = self.witches[1 - playerIndex]
+        rows = []
+        for orderIndex, order in enumerate(self.orders):
+            bonus, bonusUsesLeft = self.getUrgencyBonus(orderIndex)
+            rows.append([order.orderId, ActionType.BREW.value] + [-c for c in order.costs] + [order.price + bonus, bonus, bonusUsesLeft, 0, 0])
+        for spell in us.spells:
+            rows.append([spell.spellId, ActionType.CAST.value] + spell.deltas + [0, -1, -1, int(spell.castable), int(spell.repeatable)])
+        for spell in them.spells:
+            rows.append([spell.spellId, ActionType.OPPONENT_CAST.value] + spell.deltas + [0, -1, -1, int(spell.castable), int(spell.repeatable)])
+        for tomeIndex, tomeSpell in enumerate(self.tomeSpells):
+            repeatable = any(d < 0 for d in tomeSpell.deltas)
+            rows.append([tomeSpell.spellId, ActionType.LEARN.value] + tomeSpell.deltas + [0, tomeIndex, tomeSpell.tax, 0, int(repeatable)])
+
+        lines = [str(len(rows))]
+        lines.extend(" ".join(str(v) for v in row) for row in rows)
+        lines.extend(" ".join(str(v) for v in witch.inventory + [witch.rupees]) for witch in (us, them))
+        return lines
+
+    # Check an action against the state at the start of the round, since both witches act simultaneously
+    def validateAction(self, playerIndex: int, action: str) -> List[str]:
+        witch = self.witches[playerIndex]
+        tokens = action.split()
+        if len(tokens) == 0:
+            raise InvalidActionError("Empty action")
+        actionType = tokens[0]
+        if actionType in (ActionType.REST.value, "WAIT"):
+            return tokens
+        if len(tokens) < 2:
+            raise InvalidActionError(f"Missing id in {action}")
+        actionId = int(tokens[1])
+
+        if actionType == ActionType.BREW.value:
+            order = next((o for o in self.orders if o.orderId == actionId), None)
+            if order is None or any(have < need for have, need in zip(witch.inventory, order.costs)):
+                raise InvalidActionError(f"Can't brew {action}")
+        elif actionType == ActionType.CAST.value:
+            spell = witch.getSpell(actionId)
+            times = int(tokens[2]) if len(tokens) > 2 and tokens[2].isdigit() else 1
+            if spell is None or not spell.castable or times < 1 or (times > 1 and not spell.repeatable):
+                raise InvalidActionError(f"Can't cast {action}")
+            resultingInventory = [have + delta * times for have, delta in zip(witch.inventory, spell.deltas)]
+            if min(resultingInventory) < 0 or sum(resultingInventory) > MAX_INVENTORY_SIZE:
+                raise InvalidActionError(f"Can't cast {action} with inventory {witch.inventory}")
+            tokens = [actionType, tokens[1], str(times)]
+        elif actionType == ActionType.LEARN.value:
+            tomeIndex = next((i for i, t in enumerate(self.tomeSpells) if t.spellId == actionId), None)
+            if tomeIndex is None or witch.inventory[0] < tomeIndex:
+                raise InvalidActionError(f"Can't learn {action}")
+        else:
+            raise InvalidActionError(f"Unknown action {action}")
+
+        return tokens
+
+    def applyActions(self, actions: List[List[str]]):
+        brewedOrderIds = set()
+        learnedSpellIds = set()
+        for playerIndex, tokens in enumerate(actions):
+            witch = self.witches[playerIndex]
+            actionType = tokens[0]
+            if actionType == ActionType.REST.value:
+                for spell in witch.spells:
+                    spell.castable = True
+            elif actionType == ActionType.BREW.value:
+                orderIndex = next(i for i, o in enumerate(self.orders) if o.orderId == int(tokens[1]))
+                order = self.orders[orderIndex]
+                witch.inventory = [have - need for have, need in zip(witch.inventory, order.costs)]
+                witch.rupees += order.price + self.getUrgencyBonus(orderIndex)[0]
+                witch.potionsBrewed += 1
+                brewedOrderIds.add(order.orderId)
+            elif actionType == ActionType.CAST.value:
+                spell = witch.getSpell(int(tokens[1]))
+                times = int(tokens[2])
+                witch.inventory = [have + delta * times for have, delta in zip(witch.inventory, spell.deltas)]
+                spell.castable = False
+            elif actionType == ActionType.LEARN.value:
+                tomeIndex = next(i for i, t in enumerate(self.tomeSpells) if t.spellId == int(tokens[1]))
+                tomeSpell = self.tomeSpells[tomeIndex]
+                # Pay one tier 0 onto each spell ahead of this one, then collect whatever tax was left on it
+                witch.inventory[0] -= tomeIndex
+                for skippedTomeSpell in self.tomeSpells[:tomeIndex]:
+                    skippedTomeSpell.tax += 1
+                witch.inventory[0] += min(tomeSpell.tax, MAX_INVENTORY_SIZE - sum(witch.inventory))
+                witch.spells.append(SimulatedSpell(self.nextLearnedSpellId, list(tomeSpell.deltas), any(d < 0 for d in tomeSpell.deltas)))
+                self.nextLearnedSpellId += 1
+                learnedSpellIds.add(tomeSpell.spellId)
+
+        for orderIndex, order in reversed(list(enumerate(self.orders))):
+            if order.orderId in brewedOrderIds:
+                if self.getUrgencyBonus(orderIndex)[0] > 0:
+                    self.urgencyBonusUsesLeft[orderIndex] -= 1
+                self.orders.pop(orderIndex)
+        for tomeSpell in [t for t in self.tomeSpells if t.spellId in learnedSpellIds]:
+            self.tomeSpells.remove(tomeSpell)
+            tomeSpell.tax = 0
+        self.refill()
+
+    def isOver(self) -> bool:
+        return self.round >= MAX_ROUNDS or any(w.potionsBrewed >= POTIONS_TO_END_GAME for w in self.witches)
+
+
+######################
+###### Bot runner ####
+######################
+
+_bestTomeSpellsByToggles = {}
+
+
+def applyToggles(toggles: Dict[str, float]):
+    for name in TOGGLE_NAMES:
+        setattr(beautStrategy, name, toggles.get(name, DEFAULT_TOGGLES[name]))
+
+    # This table is derived from the toggles at import time, so it has to be rebuilt when they change
+    cacheKey = tuple(getattr(beautStrategy, name) for name in TOGGLE_NAMES)
+    if cacheKey not in _bestTomeSpellsByToggles:
+        _bestTomeSpellsByToggles[cacheKey] = beautStrategy.calculateBestTomeSpellsByOrderIndex()
+    beautStrategy.BEST_TOME_SPELLS_BY_ORDER_INDEX = _bestTomeSpellsByToggles[cacheKey]
+
+
+# Run a single turn of our bot in this process. Returns the action it printed and how long it took.
+# This is CPU time rather than wall clock time, so other processes fighting for the CPU don't count against the bot.
+def runBotTurn(toggles: Dict[str, float], frameLines: List[str]) -> Tuple[str, float]:
+    applyToggles(toggles)
+    botOutput = io.StringIO()
+    originalStdin = sys.stdin
+    sys.stdin = io.StringIO("\n".join(frameLines) + "\n")
+    try:
+        with open(os.devnull, "w") as devNull, redirect_stdout(botOutput), redirect_stderr(devNull):
+            startTime = time.thread_time()
+            beautStrategy.runAlgo(beautStrategy.parseInput())
+            endTime = time.thread_time()
+    finally:
+        sys.stdin = originalStdin
+
+    outputLines = botOutput.getvalue().splitlines()
+    return (outputLines[0] if len(outputLines) > 0 else ""), (endTime - startTime) * 1000
+
+
+# Replays are written from player 0's point of view: each turn is the frame the bot read (same as the stderr dump
+# in parseInput), then "ACTION <what it printed>", and the game ends with "RESULT <points> <our score> <their score>"
+def playGame(playerToggles: List[Dict[str, float]], seed: int, replayFile: Optional[TextIO] = None) -> GameResult:
+    game = SimulatedGame(seed)
+    latenciesMs = [[], []]
+    forfeited = [False, False]
+    while not game.isOver():
+        actions = []
+        for playerIndex in range(2):
+            frameLines = game.buildFrame(playerIndex)
+            action = ""
+            try:
+                action, latencyMs = runBotTurn(playerToggles[playerIndex], frameLines)
+                timeLimitMs = FIRST_TURN_TIME_LIMIT_MS if len(latenciesMs[playerIndex]) == 0 else TURN_TIME_LIMIT_MS
+                latenciesMs[playerIndex].append(latencyMs)
+                if latencyMs > timeLimitMs * LOCAL_TIME_LIMIT_SCALE:
+                    raise TurnTimeoutError(f"Took {latencyMs:.2f} milliseconds, limit is {timeLimitMs}")
+                actions.append(game.validateAction(playerIndex, action))
+            except Exception:
+                # Crashing, timing out or sending garbage loses the game, same as on the real servers
+                forfeited[playerIndex] = True
+            if replayFile is not None and playerIndex == 0:
+                replayFile.write("\n".join(frameLines) + "\n")
+                replayFile.write(f"ACTION {action}\n")
+        if any(forfeited):
+            break
+        game.applyActions(actions)
+        game.round += 1
+
+    scores = [w.getScore() for w in game.witches]
+    if forfeited[0] != forfeited[1]:
+        winner = 1 if forfeited[0] else 0
+    elif forfeited[0] or scores[0] == scores[1]:
+        winner = None
+    else:
+        winner = 0 if scores[0] > scores[1] else 1
+
+    result = GameResult(scores, winner, latenciesMs, forfeited, game.round)
+    if replayFile is not None:
+        replayFile.write(f"RESULT {result.getPoints(0)} {scores[0]} {scores[1]}\n")
+    return result
+
+
+if __name__ == "__main__":
+    # python referee.py [seed] [replay file]
+    gameSeed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "w") as replay:
+            result = playGame([DEFAULT_TOGGLES, DEFAULT_TOGGLES], gameSeed, replay)
+    else:
+        result = playGame([DEFAULT_TOGGLES, DEFAULT_TOGGLES], gameSeed)
+    print(result)
@@ -0,0 +1,409 @@
+import argparse
+import json
+import mmap
+import os
+import sys
+
+from array import array
+from collections import deque, defaultdict
+from typing import Optional, List, Dict, Iterator, Tuple
+
+from beautStrategy import ActionType, IngredientTier, Ingredients, StringRepresenter, ALL_ORDERS_COSTS, ALL_TOME_SPELLS_DELTAS
+
+# Streams recorded games into a columnar store for offline analysis. The inputs can be replays written by referee.py or
+# raw stderr dumps from the commented out logDebug in parseInput (those have no ACTION/RESULT lines, so the chosen
+# action and the outcome are recorded as unknown). Raw dumps also have no game boundaries, so a new game starts at any
+# frame that looks like turn 1 (both witches on the starting inventory with only the starting spells). Every column is
+# a flat binary file, so loading the store is just an mmap per column no matter how many turns are in it.
+
+#####################
+##### Constants #####
+#####################
+SCHEMA_FILE_NAME = "schema.json"
+# Column buffers get flushed to disk once they hold this many values
+FLUSH_EVERY_NUM_VALUES = 1 << 16
+WITCH_LINE_NUM_VALUES = 5
+ACTION_ROW_NUM_VALUES = 11
+# Both witches start with 3 tier 0 ingredients, no rupees and the same 4 spells
+FIRST_TURN_WITCH_LINE = [3, 0, 0, 0, 0]
+NUM_STARTING_SPELLS = 4
+# Codes stored in the turns.actionType column, -1 means we don't know what was played
+ACTION_TYPE_CODES = [ActionType.CAST.value, ActionType.LEARN.value, ActionType.BREW.value, ActionType.REST.value, "WAIT"]
+UNKNOWN = -1
+# Codes stored in the games.result column
+RESULT_LOSS = 0
+RESULT_DRAW = 1
+RESULT_WIN = 2
+
+# table -> [(column, array typecode)]
+TABLE_SCHEMAS = {
+    "games": [
+        ("gameId", "i"), ("numTurns", "h"), ("result", "b"), ("ourScore", "h"), ("theirScore", "h")
+    ],
+    "turns": [
+        ("gameId", "i"), ("turn", "h"),
+        ("inv0", "b"), ("inv1", "b"), ("inv2", "b"), ("inv3", "b"), ("rupees", "h"),
+        ("oppInv0", "b"), ("oppInv1", "b"), ("oppInv2", "b"), ("oppInv3", "b"), ("oppRupees", "h"),
+        ("actionType", "b"), ("actionId", "h"), ("actionTimes", "b")
+    ],
+    "orders": [
+        ("gameId", "i"), ("turn", "h"), ("orderId", "h"), ("recipeIndex", "b"),
+        ("cost0", "b"), ("cost1", "b"), ("cost2", "b"), ("cost3", "b"), ("price", "h"), ("urgencyBonus", "b")
+    ],
+    "tome": [
+        ("gameId", "i"), ("turn", "h"), ("spellId", "h"), ("deltaIndex", "b"), ("tomeIndex", "b"), ("tax", "b"),
+        ("delta0", "b"), ("delta1", "b"), ("delta2", "b"), ("delta3", "b")
+    ]
+}
+
+
+#####################
+###### Classes ######
+#####################
+
+class TurnFrame(StringRepresenter):
+    def __init__(self, orderRows: List[List[int]], tomeRows: List[List[int]], witchLines: List[List[int]], numSpells: List[int]):
+        self.orderRows = orderRows  # [id, d0, d1, d2, d3, price, urgencyBonus]
+        self.tomeRows = tomeRows  # [id, d0, d1, d2, d3, tomeIndex, tax]
+        self.witchLines = witchLines  # ours first, then theirs
+        self.numSpells = numSpells  # ours first, then theirs
+        self.action: Optional[List[str]] = None
+
+    def looksLikeFirstTurn(self) -> bool:
+        return all(line == FIRST_TURN_WITCH_LINE for line in self.witchLines) and all(n == NUM_STARTING_SPELLS for n in self.numSpells)
+
+
+class RecordedGame(StringRepresenter):
+    def __init__(self):
+        self.frames: List[TurnFrame] = []
+        self.points: Optional[float] = None
+        self.scores = [UNKNOWN, UNKNOWN]
+
+    def getResultCode(self) -> int:
+        if self.points is None:
+            return UNKNOWN
+        return RESULT_WIN if self.points > 0.5 else RESULT_DRAW if self.points == 0.5 else RESULT_LOSS
+
+
+class ColumnarWriter(object):
+    def __init__(self, storeDir: str):
+        os.makedirs(storeDir, exist_ok=True)
+        # The schema is written last and marks the store as complete, so drop any old one before touching the columns
+        schemaPath = os.path.join(storeDir, SCHEMA_FILE_NAME)
+        if os.path.exists(schemaPath):
+            os.remove(schemaPath)
+        self.storeDir = storeDir
+        self.rowCounts = {table: 0 for table in TABLE_SCHEMAS}
+        self.buffers = {
+            table: [array(typecode) for _, typecode in columns] for table, columns in TABLE_SCHEMAS.items()
+        }
+        self.files = {
+            table: [open(getColumnPath(storeDir, table, column), "wb") for column, _ in columns] for table, columns in TABLE_SCHEMAS.items()
+        }
+
+    def appendRow(self, table: str, values: List[int]):
+        buffers = self.buffers[table]
+        for buffer, value in zip(buffers, values):
+            buffer.append(value)
+        self.rowCounts[table] += 1
+        if len(buffers[0]) >= FLUSH_EVERY_NUM_VALUES:
+            self.flush(table)
+
+    def flush(self, table: str):
+        for buffer, columnFile in zip(self.buffers[table], self.files[table]):
+            buffer.tofile(columnFile)
+            del buffer[:]
+
+    def close(self):
+        for table in TABLE_SCHEMAS:
+            self.flush(table)
+            for columnFile in self.files[table]:
+                columnFile.close()
+
+        schema = {
+            "byteorder": sys.byteorder,
+            "tables": {
+                table: {"rows": self.rowCounts[table], "columns": dict(columns)} for table, columns in TABLE_SCHEMAS.items()
+            }
+        }
+        with open(os.path.join(self.storeDir, SCHEMA_FILE_NAME), "w") as f:
+            json.dump(schema, f, indent=2)
+
+
+class ColumnarStore(object):
+    def __init__(self, storeDir: str):
+        with open(os.path.join(storeDir, SCHEMA_FILE_NAME)) as f:
+            self.schema = json.load(f)
+        assert self.schema["byteorder"] == sys.byteorder, "Store was written on a machine with a different byte order"
+        self.storeDir = storeDir
+        self.__mmaps = []
+
+    def __enter__(self) -> 'ColumnarStore':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Releases every view handed out by getColumn, so don't keep using them after this
+    def close(self):
+        for columnMmap, columnViews in self.__mmaps:
+            for columnView in reversed(columnViews):
+                columnView.release()
+            columnMmap.close()
+        self.__mmaps = []
+
+    def getNumRows(self, table: str) -> int:
+        return self.schema["tables"][table]["rows"]
+
+    # Zero copy view of a column, indexable like a list
+    def getColumn(self, table: str, column: str) -> memoryview:
+        typecode = self.schema["tables"][table]["columns"][column]
+        if self.getNumRows(table) == 0:
+            return memoryview(array(typecode))
+        with open(getColumnPath(self.storeDir, table, column), "rb") as f:
+            columnMmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        byteView = memoryview(columnMmap)
+        columnView = byteView.cast(typecode)
+        self.__mmaps.append((columnMmap, [byteView, columnView]))
+        assert len(columnView) == self.getNumRows(table), f"{table}.{column} doesn't match the schema, re-ingest the store"
+        return columnView
+
+    def getColumns(self, table: str, columns: List[str]) -> List[memoryview]:
+        return [self.getColumn(table, column) for column in columns]
+
+
+#####################
+######## Util #######
+#####################
+
+def getColumnPath(storeDir: str, table: str, column: str) -> str:
+    return os.path.join(storeDir, f"{table}.{column}.bin")
+
+
+def findIndex(deltas: List[int], candidates: List[Ingredients]) -> int:
+    ingredients = Ingredients.fromTierArgs(*deltas)
+    for index, candidate in enumerate(candidates):
+        if candidate.equals(ingredients):
+            return index
+
+    return UNKNOWN
+
+
+def readLines(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as fileMmap:
+            for line in iter(fileMmap.readline, b""):
+                yield line.strip()
+
+
+def parseInts(line: bytes, numValues: int) -> Optional[List[int]]:
+    tokens = line.split()
+    if len(tokens) != numValues:
+        return None
+    try:
+        return [int(t) for t in tokens]
+    except ValueError:
+        return None
+
+
+# Returns None if these lines aren't a frame, e.g. other logDebug output that happened to be a number
+def parseFrame(frameLines: List[bytes]) -> Optional[TurnFrame]:
+    orderRows = []
+    tomeRows = []
+    numSpells = [0, 0]
+    for line in frameLines[:-2]:
+        tokens = line.split()
+        if len(tokens) != ACTION_ROW_NUM_VALUES:
+            return None
+        try:
+            actionId, d0, d1, d2, d3, price, tomeIndex, taxCount = [int(t) for t in tokens[:1] + tokens[2:9]]
+        except ValueError:
+            return None
+        actionType = tokens[1].decode()
+        if actionType == ActionType.BREW.value:
+            orderRows.append([actionId, abs(d0), abs(d1), abs(d2), abs(d3), abs(price), tomeIndex])
+        elif actionType == ActionType.LEARN.value:
+            tomeRows.append([actionId, d0, d1, d2, d3, tomeIndex, taxCount])
+        elif actionType == ActionType.CAST.value:
+            numSpells[0] += 1
+        elif actionType == ActionType.OPPONENT_CAST.value:
+            numSpells[1] += 1
+        elif actionType not in ActionType.__members__:
+            return None
+
+    witchLines = [parseInts(line, WITCH_LINE_NUM_VALUES) for line in frameLines[-2:]]
+    if None in witchLines:
+        return None
+    return TurnFrame(orderRows, tomeRows, witchLines, numSpells)
+
+
+def readGames(path: str) -> Iterator[RecordedGame]:
+    lines = readLines(path)
+    pushedBack = deque()
+
+    def nextLine() -> Optional[bytes]:
+        if len(pushedBack) > 0:
+            return pushedBack.popleft()
+        return next(lines, None)
+
+    game = RecordedGame()
+    while True:
+        line = nextLine()
+        if line is None:
+            break
+        if line.startswith(b"ACTION ") and len(game.frames) > 0:
+            game.frames[-1].action = line.decode().split()[1:]
+        elif line.startswith(b"RESULT "):
+            points, ourScore, theirScore = line.split()[1:4]
+            game.points = float(points)
+            game.scores = [int(ourScore), int(theirScore)]
+            yield game
+            game = RecordedGame()
+        elif line.isdigit():
+            frameLines = []
+            for _ in range(int(line) + 2):
+                frameLine = nextLine()
+                if frameLine is None:
+                    break
+                frameLines.append(frameLine)
+            frame = parseFrame(frameLines) if len(frameLines) == int(line) + 2 else None
+            if frame is None:
+                # Not actually a frame, rescan everything after the count line
+                pushedBack.extendleft(reversed(frameLines))
+            else:
+                if frame.looksLikeFirstTurn() and len(game.frames) > 0:
+                    yield game
+                    game = RecordedGame()
+                game.frames.append(frame)
+
+    if len(game.frames) > 0:
+        yield game
+
+
+def encodeAction(action: Optional[List[str]]) -> Tuple[int, int, int]:
+    if action is None or len(action) == 0 or action[0] not in ACTION_TYPE_CODES:
+        return UNKNOWN, UNKNOWN, UNKNOWN
+    actionId = int(action[1]) if len(action) > 1 and action[1].isdigit() else UNKNOWN
+    times = int(action[2]) if action[0] == ActionType.CAST.value and len(action) > 2 and action[2].isdigit() else 1
+    return ACTION_TYPE_CODES.index(action[0]), actionId, times
+
+
+#####################
+######## Algo #######
+#####################
+
+def ingest(paths: List[str], storeDir: str) -> int:
+    # Repeated order and tome rows are looked up a lot, so cache their index into the known lists
+    recipeIndexByCosts = {}
+    deltaIndexByDeltas = {}
+    writer = ColumnarWriter(storeDir)
+    gameId = 0
+    for path in paths:
+        for game in readGames(path):
+            for turn, frame in enumerate(game.frames):
+                ours, theirs = frame.witchLines
+                writer.appendRow("turns", [gameId, turn] + ours + theirs + list(encodeAction(frame.action)))
+                for orderId, *costs, price, urgencyBonus in frame.orderRows:
+                    costsKey = tuple(costs)
+                    if costsKey not in recipeIndexByCosts:
+                        recipeIndexByCosts[costsKey] = findIndex(costs, ALL_ORDERS_COSTS)
+                    writer.appendRow("orders", [gameId, turn, orderId, recipeIndexByCosts[costsKey]] + costs + [price, urgencyBonus])
+                for spellId, *deltas, tomeIndex, tax in frame.tomeRows:
+                    deltasKey = tuple(deltas)
+                    if deltasKey not in deltaIndexByDeltas:
+                        deltaIndexByDeltas[deltasKey] = findIndex(deltas, ALL_TOME_SPELLS_DELTAS)
+                    writer.appendRow("tome", [gameId, turn, spellId, deltaIndexByDeltas[deltasKey], tomeIndex, tax] + deltas)
+            writer.appendRow("games", [gameId, len(game.frames), game.getResultCode()] + game.scores)
+            gameId += 1
+
+    writer.close()
+    return gameId
+
+
+# Joins the chosen action on each turn against the rows of `table` with the same game and turn. Both tables are
+# written sorted by (gameId, turn), so this is a single linear merge instead of building an index.
+def findChosenRowValues(store: ColumnarStore, actionType: ActionType, table: str, idColumn: str, valueColumn: str) -> Dict[int, List[int]]:
+    valuesByGameId = defaultdict(list)
+    turnGameIds, turnTurns, actionTypes, actionIds = store.getColumns("turns", ["gameId", "turn", "actionType", "actionId"])
+    rowGameIds, rowTurns, rowIds, rowValues = store.getColumns(table, ["gameId", "turn", idColumn, valueColumn])
+    actionTypeCode = ACTION_TYPE_CODES.index(actionType.value)
+    rowIndex = 0
+    numRows = len(rowGameIds)
+    for turnIndex in range(len(turnGameIds)):
+        if actionTypes[turnIndex] != actionTypeCode:
+            continue
+        turnKey = (turnGameIds[turnIndex], turnTurns[turnIndex])
+        while rowIndex < numRows and (rowGameIds[rowIndex], rowTurns[rowIndex]) < turnKey:
+            rowIndex += 1
+        matchIndex = rowIndex
+        while matchIndex < numRows and (rowGameIds[matchIndex], rowTurns[matchIndex]) == turnKey:
+            if rowIds[matchIndex] == actionIds[turnIndex]:
+                valuesByGameId[turnKey[0]].append(rowValues[matchIndex])
+                break
+            matchIndex += 1
+
+    return valuesByGameId
+
+
+# Win rate of the games where we used each value at least once, next to the overall win rate
+def correlateWithWinning(valuesByGameId: Dict[int, List[int]], resultByGameId: Dict[int, int]) -> List[Tuple[int, int, float]]:
+    pointsByValue = defaultdict(float)
+    gamesByValue = defaultdict(int)
+    for gameId, values in valuesByGameId.items():
+        if resultByGameId.get(gameId, UNKNOWN) == UNKNOWN:
+            continue
+        for value in set(values):
+            gamesByValue[value] += 1
+            pointsByValue[value] += resultByGameId[gameId] / RESULT_WIN
+
+    return sorted(
+        [(value, gamesByValue[value], pointsByValue[value] / gamesByValue[value]) for value in gamesByValue],
+        key=lambda row: row[2],
+        reverse=True
+    )
+
+
+def analyze(storeDir: str):
+    with ColumnarStore(storeDir) as store:
+        analyzeStore(store)
+
+
+def analyzeStore(store: ColumnarStore):
+    gameIds, results = store.getColumns("games", ["gameId", "result"])
+    resultByGameId = {gameIds[i]: results[i] for i in range(len(gameIds))}
+    knownResults = [r for r in resultByGameId.values() if r != UNKNOWN]
+    print(f"{len(resultByGameId)} games, {store.getNumRows('turns')} turns, {len(knownResults)} games with a known result")
+    if len(knownResults) == 0:
+        return
+    print(f"Overall win rate: {sum(knownResults) / RESULT_WIN / len(knownResults):.3f}")
+
+    print("\nLearned tome spell deltas (index into ALL_TOME_SPELLS_DELTAS)")
+    learnedDeltas = findChosenRowValues(store, ActionType.LEARN, "tome", "spellId", "deltaIndex")
+    for deltaIndex, numGames, winRate in correlateWithWinning(learnedDeltas, resultByGameId):
+        delta = "unknown" if deltaIndex == UNKNOWN else [ALL_TOME_SPELLS_DELTAS[deltaIndex].getQuantity(t) for t in IngredientTier]
+        print(f"  {deltaIndex:>3} {str(delta):<18} games={numGames:<6} winRate={winRate:.3f}")
+
+    print("\nBrewed recipes (index into ALL_ORDERS_COSTS)")
+    brewedRecipes = findChosenRowValues(store, ActionType.BREW, "orders", "orderId", "recipeIndex")
+    for recipeIndex, numGames, winRate in correlateWithWinning(brewedRecipes, resultByGameId):
+        cost = "unknown" if recipeIndex == UNKNOWN else [ALL_ORDERS_COSTS[recipeIndex].getQuantity(t) for t in IngredientTier]
+        print(f"  {recipeIndex:>3} {str(cost):<18} games={numGames:<6} winRate={winRate:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest recorded games into a columnar store and mine it")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingestParser = subparsers.add_parser("ingest", help="Stream replays or stderr dumps into a store")
+    ingestParser.add_argument("store")
+    ingestParser.add_argument("paths", nargs="+")
+    analyzeParser = subparsers.add_parser("analyze", help="Correlate learned tome spells and brewed recipes with winning")
+    analyzeParser.add_argument("store")
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        numGames = ingest(args.paths, args.store)
+        print(f"Ingested {numGames} games into {args.store}")
+    else:
+        analyze(args.store)
@@ -0,0 +1,195 @@
+import argparse
+import json
+import math
+import os
+import random
+
+from typing import List, Dict, Tuple, Iterable
+from multiprocessing import Pool
+
+from beautStrategy import StringRepresenter
+from referee import DEFAULT_TOGGLES, TURN_TIME_LIMIT_MS, playGame
+
+# Searches the beautStrategy toggles with successive halving: sample a bunch of candidates, play each of them a few
+# games against the default toggles, keep the best half, double the games and repeat until one candidate is left.
+# Progress is checkpointed after every rung so a killed run picks up where it left off.
+
+#####################
+##### Constants #####
+#####################
+# name -> (low, high, type). TIER_0_WEIGHT stays at 1 so the other weights are relative to it
+TOGGLE_SPACE = {
+    "HAS_INGREDIENTS_TARGET_PERCENTAGE": (0.5, 1.0, float),
+    "ACTION_PATH_DEDUPE_MAX_SIMILAR_ACTIONS": (1, 3, int),
+    "MAX_VALID_PATHS": (5, 80, int),
+    "TOME_SPELL_ORDER_MATCHING_TARGET_PERCENTAGE": (0.4, 1.0, float),
+    "MAX_TURNS_FOR_ACTION_PATH": (2, 8, int),
+    "TIER_1_WEIGHT": (2, 8, int),
+    "TIER_2_WEIGHT": (4, 14, int),
+    "TIER_3_WEIGHT": (6, 20, int)
+}
+# Every ms of p99 turn time costs a little, so faster toggles win ties. Past the budget it costs a lot more: the
+# CodinGame servers are slower than our laptops, and 10ms over wipes out the biggest possible win rate gain.
+# Actual timeouts are already forfeits in the referee.
+LATENCY_PENALTY_PER_MS = 0.001
+LATENCY_BUDGET_MS = TURN_TIME_LIMIT_MS * 0.6
+OVER_BUDGET_LATENCY_PENALTY_PER_MS = 0.05
+# What the default toggles score against themselves, a candidate has to beat this to replace them
+BASELINE_WIN_RATE = 0.5
+
+
+#####################
+###### Classes ######
+#####################
+
+class Candidate(StringRepresenter):
+    def __init__(self, toggles: Dict[str, float], points: float = 0, gamesPlayed: int = 0, latenciesMs: List[float] = None):
+        self.toggles = toggles
+        self.points = points
+        self.gamesPlayed = gamesPlayed
+        self.latenciesMs = latenciesMs if latenciesMs is not None else []
+
+    def getWinRate(self) -> float:
+        return 0 if self.gamesPlayed == 0 else self.points / self.gamesPlayed
+
+    def getP99LatencyMs(self) -> float:
+        if len(self.latenciesMs) == 0:
+            return 0
+        sortedLatencies = sorted(self.latenciesMs)
+        return sortedLatencies[min(len(sortedLatencies) - 1, math.ceil(0.99 * len(sortedLatencies)) - 1)]
+
+    def getMaxLatencyMs(self) -> float:
+        return max(self.latenciesMs, default=0)
+
+    def getScore(self) -> float:
+        p99LatencyMs = self.getP99LatencyMs()
+        latencyOverBudgetMs = max(0, p99LatencyMs - LATENCY_BUDGET_MS)
+        return self.getWinRate() - LATENCY_PENALTY_PER_MS * p99LatencyMs - OVER_BUDGET_LATENCY_PENALTY_PER_MS * latencyOverBudgetMs
+
+    def toJson(self) -> dict:
+        return vars(self)
+
+    @staticmethod
+    def fromJson(candidateJson: dict) -> 'Candidate':
+        return Candidate(**candidateJson)
+
+
+#####################
+######## Util #######
+#####################
+
+def sampleToggles(rng: random.Random) -> Dict[str, float]:
+    toggles = dict(DEFAULT_TOGGLES)
+    for name, (low, high, toggleType) in TOGGLE_SPACE.items():
+        toggles[name] = rng.randint(low, high) if toggleType is int else round(rng.uniform(low, high), 3)
+    return toggles
+
+
+def saveCheckpoint(checkpointPath: str, checkpoint: dict):
+    # Write then rename so a crash mid write can't corrupt the previous checkpoint
+    tmpPath = checkpointPath + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmpPath, checkpointPath)
+
+
+def loadCheckpoint(checkpointPath: str) -> dict:
+    with open(checkpointPath) as f:
+        return json.load(f)
+
+
+# Runs in a worker process. The candidate swaps sides every game so neither seat gets an edge
+def playCandidateGame(task: Tuple[int, Dict[str, float], int]) -> Tuple[int, float, List[float]]:
+    candidateIndex, toggles, gameIndex = task
+    candidateSeat = gameIndex % 2
+    playerToggles = [DEFAULT_TOGGLES, DEFAULT_TOGGLES]
+    playerToggles[candidateSeat] = toggles
+    result = playGame(playerToggles, gameIndex // 2)
+    # The first turn gets a whole second, so only the regular turns count towards latency
+    return candidateIndex, result.getPoints(candidateSeat), result.latenciesMs[candidateSeat][1:]
+
+
+def playGames(pool: Pool, candidates: List[Candidate], gameIndicesPerCandidate: List[Iterable[int]]):
+    tasks = [
+        (candidateIndex, candidate.toggles, gameIndex)
+        for candidateIndex, candidate in enumerate(candidates)
+        for gameIndex in gameIndicesPerCandidate[candidateIndex]
+    ]
+    for candidateIndex, points, latenciesMs in pool.imap_unordered(playCandidateGame, tasks):
+        candidate = candidates[candidateIndex]
+        candidate.points += points
+        candidate.gamesPlayed += 1
+        candidate.latenciesMs.extend(latenciesMs)
+
+
+def printCandidate(label: str, candidate: Candidate):
+    print(f"{label} score={candidate.getScore():.3f} winRate={candidate.getWinRate():.3f} "
+          f"p99={candidate.getP99LatencyMs():.1f}ms max={candidate.getMaxLatencyMs():.1f}ms toggles={candidate.toggles}")
+
+
+#####################
+######## Algo #######
+#####################
+
+def tune(numCandidates: int, initialGamesPerCandidate: int, numValidationGames: int, checkpointPath: str, numWorkers: int,
+         seed: int) -> Candidate:
+    if os.path.exists(checkpointPath):
+        checkpoint = loadCheckpoint(checkpointPath)
+        print(f"Resuming from rung {checkpoint['rung']} of {checkpointPath}")
+    else:
+        rng = random.Random(seed)
+        # Keep the current toggles in the running as a reference point for the other candidates
+        candidates = [Candidate(dict(DEFAULT_TOGGLES))] + [Candidate(sampleToggles(rng)) for _ in range(numCandidates - 1)]
+        checkpoint = {
+            "rung": 0,
+            "gamesPerCandidate": initialGamesPerCandidate,
+            "candidates": [c.toJson() for c in candidates]
+        }
+        saveCheckpoint(checkpointPath, checkpoint)
+
+    with Pool(numWorkers) as pool:
+        while len(checkpoint["candidates"]) > 1:
+            candidates = [Candidate.fromJson(c) for c in checkpoint["candidates"]]
+            # Every candidate plays the same game seeds so they're compared on equal footing
+            playGames(pool, candidates, [range(c.gamesPlayed, checkpoint["gamesPerCandidate"]) for c in candidates])
+
+            candidates.sort(key=lambda c: c.getScore(), reverse=True)
+            for candidate in candidates:
+                printCandidate(f"rung={checkpoint['rung']}", candidate)
+
+            checkpoint = {
+                "rung": checkpoint["rung"] + 1,
+                "gamesPerCandidate": checkpoint["gamesPerCandidate"] * 2,
+                "candidates": [c.toJson() for c in candidates[:max(1, len(candidates) // 2)]]
+            }
+            saveCheckpoint(checkpointPath, checkpoint)
+
+        survivor = Candidate.fromJson(checkpoint["candidates"][0])
+        if survivor.toggles == DEFAULT_TOGGLES:
+            return survivor
+
+        # The survivor's own record is biased up since it's the luckiest of the bunch on those seeds, so only move off
+        # the defaults if it also beats them on seeds that no rung has played
+        firstValidationGame = checkpoint["gamesPerCandidate"]
+        validation = Candidate(survivor.toggles)
+        playGames(pool, [validation], [range(firstValidationGame, firstValidationGame + numValidationGames)])
+        printCandidate("validation", validation)
+
+    if validation.getScore() <= BASELINE_WIN_RATE:
+        print("Survivor didn't beat the default toggles on fresh seeds, keeping the defaults")
+        return Candidate(dict(DEFAULT_TOGGLES))
+    return validation
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune the beautStrategy toggles with locally simulated games")
+    parser.add_argument("--candidates", type=int, default=32)
+    parser.add_argument("--games", type=int, default=8, help="Games per candidate on the first rung")
+    parser.add_argument("--validation-games", type=int, default=32, help="Fresh games the survivor has to win against the defaults")
+    parser.add_argument("--checkpoint", default="tuner_checkpoint.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    best = tune(args.candidates, args.games, args.validation_games, args.checkpoint, args.workers, args.seed)
+    print(f"Best toggles: {best.toggles}")